@@ -1,82 +1,230 @@
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Depends, Request, status
+from fastapi.responses import JSONResponse, ORJSONResponse
 from supabase import create_client, Client
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from supabase.lib.client_options import ClientOptions
+from pydantic import BaseModel
+from typing import Annotated, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import asyncpg
+import atexit
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import TTLCache
+from functools import lru_cache
 import bcrypt
+import hashlib
+import httpx
 import jwt
+import logging
+import logging.handlers
+import msgspec
+import orjson
 import os
+import queue
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Logging; messages use lazy %s arguments so disabled levels cost no formatting, and records are
+# handed to a queue so the stream write happens on the listener thread rather than the event loop
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+# The queue handler only merges the message arguments; the stream handler applies the full format
+logging.basicConfig(handlers=[logging.handlers.QueueHandler(_log_queue)], format="%(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("LOG_LEVEL", "WARNING").upper())
+
 # Supabase setup
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+SUPABASE_TIMEOUT_SECONDS = 10
+
+@lru_cache(maxsize=1)
+def get_supabase() -> Client:
+    client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT_SECONDS))
+    
+    # Swap PostgREST's default session for one keep-alive HTTP/2 session shared by all requests
+    postgrest = client.postgrest
+    default_session = postgrest.session
+    postgrest.session = httpx.Client(
+        base_url=default_session.base_url,
+        headers=default_session.headers,
+        timeout=default_session.timeout,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32),
+    )
+    default_session.close()
+    return client
 
+# supabase-py is synchronous; its calls run on this many worker threads instead of blocking the event loop
+BLOCKING_IO_WORKERS = 32
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+async def sb(fn, *args, **kwargs):
+    """Run a blocking supabase-py call on the default executor"""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+# Direct Postgres connection pool; prepared statements are cached per connection
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+async def init_connection(conn: asyncpg.Connection):
+    # Decode json/jsonb columns into Python values instead of raw strings
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name, schema="pg_catalog", encoder=lambda value: orjson.dumps(value).decode(), decoder=orjson.loads
+        )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # asyncpg would otherwise fall back to libpq defaults and connect to some local database
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL is not set; point it at the Supabase Postgres connection string")
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+    )
+    app.state.pg = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=10,
+        max_size=50,
+        max_inactive_connection_lifetime=300,
+        command_timeout=60,
+        statement_cache_size=256,
+        init=init_connection,
+    )
+    try:
+        yield
+    finally:
+        await app.state.pg.close()
+
+def get_pool(request: Request) -> asyncpg.Pool:
+    return request.app.state.pg
 
 # JWT settings
 SECRET_KEY = os.getenv("SECRET_KEY", "312dadaspfaosod123")
 ALGORITHM = "HS256"
+ACCESS_TOKEN_REQUIRED_CLAIMS = ["exp", "sub", "type"]
+
+# One encoder/decoder and pre-encoded key shared by every token operation
+_jwt = jwt.PyJWT()
+_jwt_key = SECRET_KEY.encode("utf-8")
+_jwt_algorithms = [ALGORITHM]
+_jwt_decode_options = {"require": ACCESS_TOKEN_REQUIRED_CLAIMS}
 ACCESS_TOKEN_EXPIRE_MINUTES = 180
 
-app = FastAPI(title="Nutrition Bot Dashboard API")
+# Password hashing; new hashes are argon2id, legacy bcrypt hashes are still accepted and upgraded on login
+password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
 
-# CORS middleware - MUST be added before routes
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins for development
-    allow_credentials=False,  # Set to False when allowing all origins
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
-    allow_headers=["*"],
-    expose_headers=["*"],
+# Decoded tokens and their users, keyed by a short digest of the raw token
+TOKEN_CACHE_TTL_SECONDS = 60
+_token_cache = TTLCache(maxsize=4096, ttl=TOKEN_CACHE_TTL_SECONDS)
+_token_cache_lock = threading.Lock()
+
+# Users by (role, id) from the token subject, so a user's fresh tokens skip the database too; shares the token lock
+_user_cache = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# Recently failed logins, keyed by (email, short password digest); only touched from the event loop
+_recent_login_failures = TTLCache(maxsize=2048, ttl=2)
+
+# Question categories and per-trainer configs; writes here drop their entries, the TTL bounds staleness across workers
+RESPONSE_CACHE_TTL_SECONDS = 60
+_categories_cache = TTLCache(maxsize=1, ttl=RESPONSE_CACHE_TTL_SECONDS)
+_categories_fallback = None
+_trainer_config_cache = TTLCache(maxsize=1024, ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+# CORS; comma-separated origins, "*" (the default) allows all origins for development
+CORS_ALLOWED_ORIGINS = frozenset(
+    origin.strip().encode("latin-1") for origin in os.getenv("CORS_ALLOWED_ORIGINS", "*").split(",") if origin.strip()
+)
+_CORS_ALLOW_ALL = b"*" in CORS_ALLOWED_ORIGINS
+_CORS_HEADERS = (
+    (b"access-control-allow-methods", b"GET, POST, PUT, DELETE, OPTIONS, PATCH"),
+    (b"access-control-allow-headers", b"Authorization, *"),  # Authorization is never covered by the wildcard
+    (b"access-control-expose-headers", b"*"),
+)
+_CORS_PREFLIGHT_HEADERS = (
+    *_CORS_HEADERS,
+    (b"access-control-max-age", b"86400"),  # Let browsers cache preflight responses for a day
 )
 
+class CORSHeadersMiddleware:
+    """Appends precomputed CORS headers to responses and answers preflight requests without reaching the app"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        if _CORS_ALLOW_ALL:
+            allow_origin = ((b"access-control-allow-origin", b"*"),)
+        else:
+            origin = next((value for name, value in scope["headers"] if name == b"origin"), None)
+            if origin in CORS_ALLOWED_ORIGINS:
+                allow_origin = ((b"access-control-allow-origin", origin), (b"vary", b"Origin"))
+            else:
+                allow_origin = None
+        
+        if scope["method"] == "OPTIONS":
+            if allow_origin is None:
+                await send({"type": "http.response.start", "status": 403, "headers": []})
+            else:
+                await send({"type": "http.response.start", "status": 204, "headers": [*allow_origin, *_CORS_PREFLIGHT_HEADERS]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        
+        if allow_origin is None:
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_cors_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *allow_origin, *_CORS_HEADERS]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cors_headers)
+
+app = FastAPI(title="Nutrition Bot Dashboard API", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# CORS middleware - MUST be added before routes
+app.add_middleware(CORSHeadersMiddleware)
+
 # Health check endpoint
+# Liveness: answers without touching the database, so frequent probes add no load
 @app.get("/health")
 async def health_check():
+    return {"status": "healthy"}
+
+# Readiness: a bounded database round-trip, so a stuck database fails the probe instead of hanging it
+READY_TIMEOUT_SECONDS = 1
+
+@app.get("/ready")
+async def readiness_check(db: asyncpg.Pool = Depends(get_pool)):
     try:
-        # Test Supabase connection
-        response = supabase.table("question_categories").select("count").execute()
+        await asyncio.wait_for(db.fetchval("SELECT 1"), timeout=READY_TIMEOUT_SECONDS)
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
-        return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
-
-# Add comprehensive CORS headers to all responses
-@app.middleware("http")
-async def add_cors_headers(request, call_next):
-    response = await call_next(request)
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
-    response.headers["Access-Control-Allow-Headers"] = "*"
-    response.headers["Access-Control-Expose-Headers"] = "*"
-    return response
-
-# Add OPTIONS handler for CORS preflight requests
-@app.options("/{path:path}")
-async def options_handler(path: str):
-    return {"message": "OK"}
-
-# Add specific OPTIONS handler for trainer analytics
-@app.options("/trainer/analytics")
-async def options_trainer_analytics():
-    return {"message": "OK"}
-
-# Add specific OPTIONS handler for trainer users analytics
-@app.options("/trainer/users-analytics")
-async def options_trainer_users_analytics():
-    return {"message": "OK"}
+        return ORJSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "unhealthy", "database": "disconnected", "error": str(e) or type(e).__name__},
+        )
 
 # Test trainer analytics without authentication
 @app.get("/trainer/analytics-test")
 async def get_trainer_analytics_test():
     try:
-        print("Testing trainer analytics endpoint without authentication")
+        logger.debug("Testing trainer analytics endpoint without authentication")
         return {
             "total_messages": 0,
             "daily_messages": {},
@@ -84,7 +232,7 @@ async def get_trainer_analytics_test():
             "test": True
         }
     except Exception as e:
-        print(f"Error in test analytics: {e}")
+        logger.error("Error in test analytics: %s", e)
         return {
             "total_messages": 0,
             "daily_messages": {},
@@ -93,20 +241,86 @@ async def get_trainer_analytics_test():
             "error": str(e)
         }
 
-# Security
-security = HTTPBearer()
+# Auth models are msgspec structs, decoded from and encoded to JSON bytes without an intermediate dict
+Email = Annotated[str, msgspec.Meta(pattern=r"^[^@\s]+@[^@\s]+\.[^@\s]+$")]
 
-# Pydantic models
-class UserLogin(BaseModel):
-    email: EmailStr
+class UserLogin(msgspec.Struct):
+    email: Email
     password: str
 
-class UserRegister(BaseModel):
-    email: EmailStr
+class UserRegister(msgspec.Struct):
+    email: Email
     password: str
     name: str
     registration_code: str
 
+class Token(msgspec.Struct):
+    access_token: str
+    token_type: str
+
+class UserInfo(msgspec.Struct):
+    id: str
+    email: str
+    name: str
+    role: str
+
+class ChangeNameRequest(msgspec.Struct):
+    name: str
+
+class ChangePasswordRequest(msgspec.Struct):
+    current_password: str
+    new_password: str
+
+class MsgspecResponse(JSONResponse):
+    # A JSONResponse subclass so OpenAPI documents it as JSON rather than a plain string
+    def render(self, content) -> bytes:
+        return msgspec.json.encode(content)
+
+def msgspec_body(model):
+    """Dependency decoding the JSON request body into the given msgspec struct"""
+    async def decode_body(request: Request):
+        try:
+            return msgspec.json.decode(await request.body(), type=model)
+        except (msgspec.ValidationError, msgspec.DecodeError) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return decode_body
+
+def token_response(access_token: str) -> MsgspecResponse:
+    return MsgspecResponse(Token(access_token=access_token, token_type="bearer"))
+
+# OpenAPI for the msgspec routes; FastAPI can't see through msgspec_body or MsgspecResponse, so the
+# schemas are generated by msgspec and attached per route, with their definitions merged into the components
+_msgspec_models = (UserLogin, UserRegister, Token, UserInfo, ChangeNameRequest, ChangePasswordRequest)
+_msgspec_schemas, _msgspec_components = msgspec.json.schema_components(
+    _msgspec_models, ref_template="#/components/schemas/{name}"
+)
+_msgspec_schema_by_model = dict(zip(_msgspec_models, _msgspec_schemas))
+
+def msgspec_request_body(model) -> dict:
+    """openapi_extra documenting a msgspec_body(model) request body"""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": _msgspec_schema_by_model[model]}},
+        }
+    }
+
+def msgspec_response(model) -> dict:
+    """responses documenting a 200 whose body is the given msgspec struct"""
+    return {200: {"description": "Successful Response", "content": {"application/json": {"schema": _msgspec_schema_by_model[model]}}}}
+
+_default_openapi = app.openapi
+
+def openapi_with_msgspec_components() -> dict:
+    if app.openapi_schema is None:
+        schema = _default_openapi()
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(_msgspec_components)
+    return app.openapi_schema
+
+app.openapi = openapi_with_msgspec_components
+
+# Pydantic models
+
 class RegistrationCodeCreate(BaseModel):
     code: str
     expires_at: Optional[datetime] = None
@@ -127,16 +341,6 @@ class QuestionUpdate(BaseModel):
     question_text: Optional[str] = None
     step_order: Optional[int] = None
 
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-
-class UserInfo(BaseModel):
-    id: str
-    email: str
-    name: str
-    role: str
-
 class CategoryCreate(BaseModel):
     name: str
 
@@ -169,33 +373,134 @@ class TrainerReminderSettingsUpdate(BaseModel):
 
 # Authentication functions
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return password_hasher.hash(password)
+
+def is_bcrypt_hash(hashed: str) -> bool:
+    return hashed.startswith("$2")
 
 def verify_password(password: str, hashed: str) -> bool:
-    try:
-        # Check if the hash looks like a valid bcrypt hash
-        if not hashed.startswith('$2a$') and not hashed.startswith('$2b$') and not hashed.startswith('$2y$'):
-            print(f"Invalid bcrypt hash format: {hashed}")
+    if is_bcrypt_hash(hashed):
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        except (ValueError, TypeError) as e:
+            logger.warning("Error verifying password: %s", e)
             return False
-        
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
-    except (ValueError, TypeError) as e:
-        print(f"Error verifying password: {e}")
-        print(f"Hash that caused error: {hashed}")
+    
+    try:
+        return password_hasher.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
         return False
 
+def password_needs_rehash(hashed: str) -> bool:
+    return is_bcrypt_hash(hashed) or password_hasher.check_needs_rehash(hashed)
+
+# Password hashing is deliberately slow, so keep it off the event loop
+async def hash_password_async(password: str) -> str:
+    return await asyncio.to_thread(hash_password, password)
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    return await asyncio.to_thread(verify_password, password, hashed)
+
+async def upgrade_password_hash(table: str, user: dict, password: str):
+    # Called after a successful login; a failed upgrade must not fail the login
+    if not password_needs_rehash(user["password_hash"]):
+        return
+    try:
+        new_password_hash = await hash_password_async(password)
+        await sb(lambda: get_supabase().table(table).update({"password_hash": new_password_hash}).eq("id", user["id"]).execute())
+    except Exception as e:
+        logger.warning("Could not upgrade password hash for %s: %s", user['id'], e)
+
+# Verified against when no account matches, so unknown emails cost the same hashing work as wrong passwords
+DUMMY_PASSWORD_HASH = hash_password("dummy-password")
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    print(f"Created access token expiring at: {expire.isoformat()} (in {ACCESS_TOKEN_EXPIRE_MINUTES} minutes)")
+    encoded_jwt = _jwt.encode(to_encode, _jwt_key, algorithm=ALGORITHM)
+    logger.debug("Created access token expiring at: %s (in %s minutes)", expire, ACCESS_TOKEN_EXPIRE_MINUTES)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def _decode_token_cached(token: str):
+    """Return (payload, user) for a token, skipping signature checks on a cache hit.
+
+    user is None when the token has been decoded but its user not fetched yet.
+    """
+    key = _token_cache_key(token)
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is not None:
+            # exp is still enforced for cached tokens
+            if entry[0].get("exp", 0) > time.time():
+                return entry
+            del _token_cache[key]
+    
+    payload = _jwt.decode(token, _jwt_key, algorithms=_jwt_algorithms, options=_jwt_decode_options)
+    return payload, None
+
+def _cache_token_user(token: str, payload: dict, user: dict):
+    with _token_cache_lock:
+        _token_cache[_token_cache_key(token)] = (payload, user)
+
+def _forget_cached_user(user_id: str):
+    # Drop cached users after writes that change what get_current_user returns
+    with _token_cache_lock:
+        stale_keys = [key for key, (_, user) in _token_cache.items() if user and user.get("id") == user_id]
+        for key in stale_keys:
+            _token_cache.pop(key, None)
+        for role in ("admin", "trainer"):
+            _user_cache.pop((role, user_id), None)
+
+def _load_user(user_type: str, user_id: str) -> dict:
+    """Active admin or trainer for a token subject, from the per-user cache or the database"""
+    with _token_cache_lock:
+        user = _user_cache.get((user_type, user_id))
+    if user is not None:
+        return user
+    
+    if user_type == "admin":
+        response = get_supabase().table("admins").select("*").eq("id", user_id).execute()
+        if not response.data or not response.data[0].get("is_active", True):
+            raise HTTPException(status_code=401, detail="Admin not found or inactive")
+        user = response.data[0]
+        user["role"] = "admin"
+    elif user_type == "trainer":
+        response = get_supabase().table("trainers").select("*").eq("id", user_id).execute()
+        if not response.data or not response.data[0].get("is_active", True):
+            raise HTTPException(status_code=401, detail="Trainer not found or inactive")
+        user = response.data[0]
+        user["role"] = "trainer"
+    else:
+        raise HTTPException(status_code=401, detail="Invalid user type")
+    
+    with _token_cache_lock:
+        _user_cache[(user_type, user_id)] = user
+    return user
+
+def _bearer_token(request: Request) -> str:
+    # Parse the bearer token by hand rather than through HTTPBearer's security dependency
+    authorization = request.headers.get("authorization", "")
+    if authorization[:7].lower() != "bearer " or not authorization[7:]:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return authorization[7:]
+
+def create_user_access_token(user_id: str, role: str, email: str, name: str):
+    # email and name ride along in the token so get_current_user_lite can answer without the database
+    return create_access_token(data={"sub": user_id, "type": role, "email": email, "name": name})
+
+def get_current_user(request: Request):
+    """Database-backed current user; use wherever stale or deactivated accounts matter"""
+    token = _bearer_token(request)
+    
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload, cached_user = _decode_token_cached(token)
+        if cached_user is not None:
+            return dict(cached_user)
+        
         user_id = payload.get("sub")
         user_type = payload.get("type")  # "admin" or "trainer"
         
@@ -204,29 +509,35 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    # Get real user data from database
+    # Get real user data from the per-user cache or the database
     try:
-        if user_type == "admin":
-            response = supabase.table("admins").select("*").eq("id", user_id).execute()
-            if not response.data or not response.data[0].get("is_active", True):
-                raise HTTPException(status_code=401, detail="Admin not found or inactive")
-            user = response.data[0]
-            user["role"] = "admin"
-            return user
-        elif user_type == "trainer":
-            response = supabase.table("trainers").select("*").eq("id", user_id).execute()
-            if not response.data or not response.data[0].get("is_active", True):
-                raise HTTPException(status_code=401, detail="Trainer not found or inactive")
-            user = response.data[0]
-            user["role"] = "trainer"
-            return user
-        else:
-            raise HTTPException(status_code=401, detail="Invalid user type")
+        user = _load_user(user_type, user_id)
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Database error in get_current_user: {e}")
+        logger.error("Database error in get_current_user: %s", e)
         raise HTTPException(status_code=401, detail="User not found")
+    
+    _cache_token_user(token, payload, user)
+    return dict(user)
+
+def get_current_user_lite(request: Request):
+    """Current user from token claims alone, falling back to the database for tokens without them"""
+    token = _bearer_token(request)
+    try:
+        payload, _ = _decode_token_cached(token)
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    if payload.get("type") not in ("admin", "trainer") or "email" not in payload or "name" not in payload:
+        return get_current_user(request)
+    
+    return {
+        "id": payload["sub"],
+        "email": payload["email"],
+        "name": payload["name"],
+        "role": payload["type"]
+    }
 
 def require_admin(current_user = Depends(get_current_user)):
     if current_user["role"] != "admin":
@@ -239,83 +550,94 @@ def require_trainer_or_admin(current_user = Depends(get_current_user)):
     return current_user
 
 # API Routes
-@app.post("/auth/login", response_model=Token)
-async def login(user_credentials: UserLogin):
+@app.post(
+    "/auth/login",
+    response_class=MsgspecResponse,
+    responses=msgspec_response(Token),
+    openapi_extra=msgspec_request_body(UserLogin),
+)
+async def login(user_credentials: UserLogin = Depends(msgspec_body(UserLogin))):
     try:
         # For development with mock data, allow login with admin credentials
         if user_credentials.email == "admin@nutritionbot.com" and user_credentials.password == "admin123":
             access_token = create_access_token(data={"sub": "1a96d102-7805-44f4-9a6e-67bffbf879ff", "type": "admin"})
-            return {"access_token": access_token, "token_type": "bearer"}
+            return token_response(access_token)
+        
+        # Repeats of a login that just failed are rejected without touching the database or password hashing
+        failure_key = (user_credentials.email, hashlib.blake2b(user_credentials.password.encode(), digest_size=8).digest())
+        if failure_key in _recent_login_failures:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
         
         # First check admins table
-        admin_response = supabase.table("admins").select("*").eq("email", user_credentials.email).execute()
+        password_checked = False
+        admin_response = await sb(lambda: get_supabase().table("admins").select("*").eq("email", user_credentials.email).execute())
         if admin_response.data:
             admin_user = admin_response.data[0]
-            if verify_password(user_credentials.password, admin_user["password_hash"]):
-                access_token = create_access_token(data={"sub": admin_user["id"], "type": "admin"})
-                return {"access_token": access_token, "token_type": "bearer"}
+            password_checked = True
+            if await verify_password_async(user_credentials.password, admin_user["password_hash"]):
+                await upgrade_password_hash("admins", admin_user, user_credentials.password)
+                access_token = create_user_access_token(admin_user["id"], "admin", admin_user["email"], admin_user["name"])
+                return token_response(access_token)
         
         # Then check trainers table
-        trainer_response = supabase.table("trainers").select("*").eq("email", user_credentials.email).execute()
+        trainer_response = await sb(lambda: get_supabase().table("trainers").select("*").eq("email", user_credentials.email).execute())
         if trainer_response.data:
             trainer_user = trainer_response.data[0]
-            if verify_password(user_credentials.password, trainer_user["password_hash"]):
-                access_token = create_access_token(data={"sub": trainer_user["id"], "type": "trainer"})
-                return {"access_token": access_token, "token_type": "bearer"}
+            password_checked = True
+            if await verify_password_async(user_credentials.password, trainer_user["password_hash"]):
+                await upgrade_password_hash("trainers", trainer_user, user_credentials.password)
+                access_token = create_user_access_token(trainer_user["id"], "trainer", trainer_user["email"], trainer_user["name"])
+                return token_response(access_token)
+        
+        # Equalize timing for unknown emails
+        if not password_checked:
+            await verify_password_async(user_credentials.password, DUMMY_PASSWORD_HASH)
         
+        _recent_login_failures[failure_key] = True
         raise HTTPException(status_code=401, detail="Invalid credentials")
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Login error: {e}")
+        logger.error("Login error: %s", e)
         raise HTTPException(status_code=500, detail="Login failed")
 
-@app.post("/auth/register", response_model=UserInfo)
-async def register(user_data: UserRegister):
+@app.post(
+    "/auth/register",
+    response_class=MsgspecResponse,
+    responses=msgspec_response(Token),
+    openapi_extra=msgspec_request_body(UserRegister),
+)
+async def register(user_data: UserRegister = Depends(msgspec_body(UserRegister))):
     try:
-        print(f"Registration attempt for: {user_data.email}")
-        print(f"Registration code: {user_data.registration_code}")
+        logger.debug("Registration attempt for: %s", user_data.email)
+        logger.debug("Registration code: %s", user_data.registration_code)
         
-        # Check registration code
+        # Validate the code and probe both account tables concurrently
         try:
-            reg_code_response = supabase.table("registration_codes").select("*").eq("code", user_data.registration_code).execute()
-            print(f"Registration code query response: {reg_code_response}")
-            print(f"Registration code check result: {reg_code_response.data}")
+            reg_code_response, admin_check, trainer_check = await asyncio.gather(
+                sb(
+                    lambda: get_supabase().rpc("validate_registration_code", {"p_code": user_data.registration_code}).execute()
+                ),
+                sb(lambda: get_supabase().table("admins").select("id").eq("email", user_data.email).limit(1).execute()),
+                sb(lambda: get_supabase().table("trainers").select("id").eq("email", user_data.email).limit(1).execute()),
+            )
+            logger.debug("Registration code check result: %s", reg_code_response.data)
         except Exception as e:
-            print(f"Error querying registration codes table: {e}")
+            logger.error("Error checking registration code: %s", e)
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
         
+        # Used, assigned and expired codes are filtered out server-side, see migrations/003_validate_registration_code.sql
         if not reg_code_response.data:
-            raise HTTPException(status_code=400, detail="Invalid or expired registration code")
+            raise HTTPException(status_code=400, detail="Invalid, expired or already used registration code")
         
-        # Check if registration code is already used
-        reg_code = reg_code_response.data[0]
-        if reg_code.get("is_used", False):
-            raise HTTPException(status_code=400, detail="Registration code has already been used")
-        
-        # Check if registration code is already assigned to someone
-        if reg_code.get("used_by"):
-            raise HTTPException(status_code=400, detail="Registration code has already been used")
-        
-        # Check if registration code is expired
-        if reg_code_response.data[0].get("expires_at"):
-            from datetime import datetime
-            expires_at = datetime.fromisoformat(reg_code_response.data[0]["expires_at"].replace('Z', '+00:00'))
-            if datetime.utcnow() > expires_at:
-                raise HTTPException(status_code=400, detail="Registration code has expired")
-        
-        # Check if user exists in either table
-        admin_check = supabase.table("admins").select("*").eq("email", user_data.email).execute()
-        trainer_check = supabase.table("trainers").select("*").eq("email", user_data.email).execute()
-        
-        print(f"Admin check: {admin_check.data}")
-        print(f"Trainer check: {trainer_check.data}")
+        logger.debug("Admin check: %s", admin_check.data)
+        logger.debug("Trainer check: %s", trainer_check.data)
         
         if admin_check.data or trainer_check.data:
             raise HTTPException(status_code=400, detail="User already exists")
         
         # Create new trainer
-        hashed_password = hash_password(user_data.password)
+        hashed_password = await hash_password_async(user_data.password)
         new_trainer_data = {
             "email": user_data.email,
             "password_hash": hashed_password,
@@ -323,117 +645,90 @@ async def register(user_data: UserRegister):
             "is_active": True
         }
         
-        print(f"Creating trainer with data: {new_trainer_data}")
+        logger.debug("Creating trainer: %s", user_data.email)
         try:
-            user_response = supabase.table("trainers").insert(new_trainer_data).execute()
-            print(f"Trainer creation response: {user_response.data}")
+            user_response = await sb(lambda: get_supabase().table("trainers").insert(new_trainer_data).execute())
         except Exception as e:
-            print(f"Error creating trainer: {e}")
+            logger.error("Error creating trainer: %s", e)
             raise HTTPException(status_code=500, detail=f"Failed to create trainer: {str(e)}")
         
         if not user_response.data:
             raise HTTPException(status_code=500, detail="Failed to create trainer - no data returned")
         
         new_user = user_response.data[0]
+        logger.debug("Created trainer: %s", new_user["id"])
         
-        # Update registration code usage
-        # update_data = {
-        #     "used_by": new_user["id"],
-        #     "is_used": True
-        # }
-
-        update_data = {
-            "used_by": None,
-            "is_used": False
-        }
-        
-        try:
-            supabase.table("registration_codes").update(update_data).eq("code", user_data.registration_code).execute()
-            print(f"Updated registration code usage for: {user_data.registration_code}")
-        except Exception as update_error:
-            print(f"Warning: Could not update registration code usage: {update_error}")
-            # Continue anyway since the user was created successfully
-        
-        return UserInfo(
+        return MsgspecResponse(UserInfo(
             id=new_user["id"],
             email=new_user["email"],
             name=new_user["name"],
             role="trainer"
-        )
+        ))
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Registration error: {e}")
+        logger.error("Registration error: %s", e)
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
-@app.get("/auth/me", response_model=UserInfo)
-async def get_current_user_info(current_user = Depends(get_current_user)):
-    print(f"Getting user info for: {current_user}")
+@app.get("/auth/me", response_class=MsgspecResponse, responses=msgspec_response(UserInfo))
+async def get_current_user_info(current_user = Depends(get_current_user_lite)):
+    logger.debug("Getting user info for: %s", current_user['id'])
     user_info = UserInfo(
         id=current_user["id"],
         email=current_user["email"],
         name=current_user["name"],
         role=current_user["role"]
     )
-    print(f"Returning user info: {user_info}")
-    return user_info
+    logger.debug("Returning user info: %s", user_info)
+    return MsgspecResponse(user_info)
 
 # Change name endpoint
-class ChangeNameRequest(BaseModel):
-    name: str
-
-class ChangePasswordRequest(BaseModel):
-    current_password: str
-    new_password: str
-
-@app.put("/auth/change-name")
+@app.put("/auth/change-name", openapi_extra=msgspec_request_body(ChangeNameRequest))
 async def change_name(
-    name_data: ChangeNameRequest,
+    name_data: ChangeNameRequest = Depends(msgspec_body(ChangeNameRequest)),
     current_user = Depends(get_current_user)
 ):
     try:
-        print(f"=== CHANGE NAME REQUEST ===")
-        print(f"Current user data: {current_user}")
-        print(f"Changing name for user {current_user['id']} to '{name_data.name}'")
-        print(f"User role: {current_user['role']}")
-        print(f"Current name in DB: {current_user.get('name', 'NOT SET')}")
+        logger.debug(
+            "Changing name for %s %s from '%s' to '%s'",
+            current_user['role'], current_user['id'], current_user.get('name', 'NOT SET'), name_data.name
+        )
         
         if current_user["role"] == "admin":
             # Update admin name
-            print("Updating admin name in database...")
-            result = supabase.table("admins").update({"name": name_data.name}).eq("id", current_user["id"]).execute()
-            print(f"Admin update result: {result}")
+            result = await sb(lambda: get_supabase().table("admins").update({"name": name_data.name}).eq("id", current_user["id"]).execute())
+            logger.debug("Admin update matched %s row(s)", len(result.data))
         elif current_user["role"] == "trainer":
             # Update trainer name
-            print("Updating trainer name in database...")
-            result = supabase.table("trainers").update({"name": name_data.name}).eq("id", current_user["id"]).execute()
-            print(f"Trainer update result: {result}")
+            result = await sb(lambda: get_supabase().table("trainers").update({"name": name_data.name}).eq("id", current_user["id"]).execute())
+            logger.debug("Trainer update matched %s row(s)", len(result.data))
         else:
-            print(f"Unknown user role: {current_user['role']}")
+            logger.warning("Unknown user role: %s", current_user['role'])
             raise HTTPException(status_code=400, detail="Invalid user role")
         
-        print("Name change successful")
-        return {"message": "Name changed successfully"}
+        _forget_cached_user(current_user["id"])
+        logger.debug("Name change successful")
+        # Re-issue the token so /auth/me reports the new name
+        access_token = create_user_access_token(current_user["id"], current_user["role"], current_user["email"], name_data.name)
+        return {"message": "Name changed successfully", "access_token": access_token, "token_type": "bearer"}
     except Exception as e:
-        print(f"Change name error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Change name error: %s", e)
         raise HTTPException(status_code=500, detail="Failed to change name")
 
-@app.put("/auth/change-password")
+@app.put("/auth/change-password", openapi_extra=msgspec_request_body(ChangePasswordRequest))
 async def change_password(
-    password_data: ChangePasswordRequest,
+    password_data: ChangePasswordRequest = Depends(msgspec_body(ChangePasswordRequest)),
     current_user = Depends(get_current_user)
 ):
     try:
         # Verify current password
         if current_user["role"] == "admin":
-            admin_response = supabase.table("admins").select("*").eq("id", current_user["id"]).execute()
+            admin_response = await sb(lambda: get_supabase().table("admins").select("*").eq("id", current_user["id"]).execute())
             if not admin_response.data:
                 raise HTTPException(status_code=404, detail="Admin not found")
             stored_password = admin_response.data[0]["password_hash"]
         elif current_user["role"] == "trainer":
-            trainer_response = supabase.table("trainers").select("*").eq("id", current_user["id"]).execute()
+            trainer_response = await sb(lambda: get_supabase().table("trainers").select("*").eq("id", current_user["id"]).execute())
             if not trainer_response.data:
                 raise HTTPException(status_code=404, detail="Trainer not found")
             stored_password = trainer_response.data[0]["password_hash"]
@@ -441,23 +736,24 @@ async def change_password(
             raise HTTPException(status_code=400, detail="Invalid user role")
         
         # Verify current password
-        if not verify_password(password_data.current_password, stored_password):
+        if not await verify_password_async(password_data.current_password, stored_password):
             raise HTTPException(status_code=400, detail="Current password is incorrect")
         
         # Hash new password
-        new_password_hash = hash_password(password_data.new_password)
+        new_password_hash = await hash_password_async(password_data.new_password)
         
         # Update password in database
         if current_user["role"] == "admin":
-            supabase.table("admins").update({"password_hash": new_password_hash}).eq("id", current_user["id"]).execute()
+            await sb(lambda: get_supabase().table("admins").update({"password_hash": new_password_hash}).eq("id", current_user["id"]).execute())
         elif current_user["role"] == "trainer":
-            supabase.table("trainers").update({"password_hash": new_password_hash}).eq("id", current_user["id"]).execute()
+            await sb(lambda: get_supabase().table("trainers").update({"password_hash": new_password_hash}).eq("id", current_user["id"]).execute())
         
+        _forget_cached_user(current_user["id"])
         return {"message": "Password changed successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Change password error: {e}")
+        logger.error("Change password error: %s", e)
         raise HTTPException(status_code=500, detail="Failed to change password")
 
 # Admin routes
@@ -467,13 +763,13 @@ async def create_registration_code(
     current_user = Depends(require_admin)
 ):
     try:
-        print(f"Creating registration code with data: {code_data}")
-        print(f"Current user: {current_user}")
+        logger.debug("Creating registration code with data: %s", code_data)
+        logger.debug("Current user: %s", current_user['id'])
         
         # Check if code already exists
-        existing_response = supabase.table("registration_codes").select("*").eq("code", code_data.code).execute()
+        existing_response = await sb(lambda: get_supabase().table("registration_codes").select("*").eq("code", code_data.code).execute())
         if existing_response.data:
-            print(f"Code already exists: {existing_response.data}")
+            logger.debug("Code already exists: %s", existing_response.data)
             raise HTTPException(status_code=400, detail="Registration code already exists")
         
         # Handle expires_at - it might come as string or datetime
@@ -496,170 +792,91 @@ async def create_registration_code(
         if hasattr(code_data, 'description') and code_data.description:
             new_code_data["description"] = code_data.description
         
-        print(f"Inserting new code data: {new_code_data}")
+        logger.debug("Inserting new code data: %s", new_code_data)
         
         try:
-            response = supabase.table("registration_codes").insert(new_code_data).execute()
-            print(f"Insert response: {response}")
+            response = await sb(lambda: get_supabase().table("registration_codes").insert(new_code_data).execute())
+            logger.debug("Insert response: %s", response)
         except Exception as insert_error:
-            print(f"Insert error: {insert_error}")
+            logger.error("Insert error: %s", insert_error)
             raise HTTPException(status_code=500, detail=f"Failed to create registration code: {str(insert_error)}")
         
         if not response.data:
-            print(f"No data returned from insert: {response}")
+            logger.error("No data returned from insert: %s", response)
             raise HTTPException(status_code=500, detail="Failed to create registration code - no data returned")
         
         return {"message": "Registration code created successfully", "code": response.data[0]}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error creating registration code: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error creating registration code: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to create registration code: {str(e)}")
 
 @app.get("/admin/trainers")
-async def get_all_trainers(current_user = Depends(require_admin)):
+async def get_all_trainers(current_user = Depends(require_admin), db: asyncpg.Pool = Depends(get_pool)):
     try:
-        response = supabase.table("trainers").select("*").execute()
-        trainers = response.data or []
-        
-        # Get additional stats for each trainer
-        trainers_with_stats = []
-        for trainer in trainers:
-            # Get user count for this trainer
-            users_response = supabase.table("users").select("id").eq("selected_trainer_id", trainer["id"]).execute()
-            user_count = len(users_response.data or [])
-            
-            # Get message count for this trainer
-            messages_response = supabase.table("bot_messages").select("id").eq("trainer_id", trainer["id"]).execute()
-            message_count = len(messages_response.data or [])
-            
-            # Get last activity
-            last_message_response = supabase.table("bot_messages").select("sent_at").eq("trainer_id", trainer["id"]).order("sent_at", desc=True).limit(1).execute()
-            last_activity = last_message_response.data[0]["sent_at"] if last_message_response.data else None
-            
-            trainers_with_stats.append({
-                "id": trainer["id"],
-                "name": trainer["name"],
-                "email": trainer["email"],
-                "is_active": trainer.get("is_active", True),
-                "created_at": trainer["created_at"],
-                "user_count": user_count,
-                "message_count": message_count,
-                "last_activity": last_activity
-            })
-        
-        return trainers_with_stats
+        # Counts and last activity are aggregated server-side, see migrations/001_trainer_dashboard_stats.sql
+        rows = await db.fetch("SELECT * FROM trainer_dashboard_stats()")
+        return [dict(row) for row in rows]
     except Exception as e:
-        print(f"Error fetching trainers: {e}")
+        logger.error("Error fetching trainers: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch trainers")
 
 @app.get("/admin/users")
-async def get_all_users(current_user = Depends(require_admin)):
+async def get_all_users(current_user = Depends(require_admin), db: asyncpg.Pool = Depends(get_pool)):
     try:
-        response = supabase.table("users").select("*").execute()
-        users = response.data or []
-        
-        # Get additional stats for each user
-        users_with_stats = []
-        for user in users:
-            # Get message count for this user
-            messages_response = supabase.table("bot_messages").select("id").eq("user_id", user["id"]).execute()
-            message_count = len(messages_response.data or [])
-            
-            # Get last interaction
-            last_message_response = supabase.table("bot_messages").select("sent_at").eq("user_id", user["id"]).order("sent_at", desc=True).limit(1).execute()
-            last_interaction = last_message_response.data[0]["sent_at"] if last_message_response.data else None
-            
-            # Get trainer name
-            trainer_name = "No trainer"
-            if user.get("selected_trainer_id"):
-                trainer_response = supabase.table("trainers").select("name").eq("id", user["selected_trainer_id"]).execute()
-                if trainer_response.data:
-                    trainer_name = trainer_response.data[0]["name"]
-            
-            users_with_stats.append({
-                "id": user["id"],
-                "name": user["name"],
-                "timezone": user.get("timezone"),
-                "location": user.get("location"),
-                "weight": user.get("weight"),
-                "height": user.get("height"),
-                "gender": user.get("gender"),
-                "selected_trainer_id": user.get("selected_trainer_id"),
-                "trainer_name": trainer_name,
-                "message_count": message_count,
-                "last_interaction": last_interaction,
-                "created_at": user.get("created_at")
-            })
-        
-        return users_with_stats
+        # Trainer names and message stats are joined server-side, see migrations/002_users_with_stats.sql
+        rows = await db.fetch(
+            """
+            SELECT id, name, timezone, location, weight, height, gender,
+                   selected_trainer_id, trainer_name, message_count, last_interaction, created_at
+            FROM users_with_stats
+            """
+        )
+        return [dict(row) for row in rows]
     except Exception as e:
-        print(f"Error fetching users: {e}")
+        logger.error("Error fetching users: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch users")
 
 @app.get("/admin/analytics")
-async def get_admin_analytics(current_user = Depends(require_admin)):
+async def get_admin_analytics(current_user = Depends(require_admin), db: asyncpg.Pool = Depends(get_pool)):
     try:
-        print(f"Fetching analytics for user: {current_user['id']}")
-        
-        # Get actual data from database
-        # Get total trainers
-        trainers_response = supabase.table("trainers").select("id", "is_active").execute()
-        total_trainers = len(trainers_response.data or [])
-        active_trainers = len([t for t in (trainers_response.data or []) if t.get("is_active", True)])
-        
-        # Get total users
-        users_response = supabase.table("users").select("id").execute()
-        total_users = len(users_response.data or [])
-        
-        # Get total messages
-        messages_response = supabase.table("bot_messages").select("id", "sent_at").execute()
-        total_messages = len(messages_response.data or [])
-        
-        # Get recent messages (last 7 days)
-        from datetime import datetime, timedelta
-        seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        recent_messages = 0
-        if messages_response.data:
-            for msg in messages_response.data:
-                if msg.get("sent_at"):
-                    try:
-                        msg_date = datetime.fromisoformat(msg["sent_at"].replace('Z', '+00:00'))
-                        if msg_date >= seven_days_ago:
-                            recent_messages += 1
-                    except:
-                        pass
-        
-        # Get registration codes stats
-        codes_response = supabase.table("registration_codes").select("*").execute()
-        total_codes = len(codes_response.data or [])
-        used_codes = len([c for c in (codes_response.data or []) if c.get("is_used", False)])
-        active_codes = len([c for c in (codes_response.data or []) if not c.get("is_used", False)])
+        logger.debug("Fetching analytics for user: %s", current_user['id'])
+        
+        # The queries are independent, so run them concurrently on separate pool connections
+        trainers, total_users, total_messages, recent_messages, code_stats = await asyncio.gather(
+            db.fetch(
+                "SELECT id, name, is_active, user_count, message_count FROM trainer_dashboard_stats() ORDER BY message_count DESC"
+            ),
+            db.fetchval("SELECT count(*) FROM users"),
+            db.fetchval("SELECT count(*) FROM bot_messages"),
+            db.fetchval("SELECT count(*) FROM bot_messages WHERE sent_at >= now() - interval '7 days'"),
+            db.fetchrow(
+                "SELECT count(*) AS total_codes, count(*) FILTER (WHERE coalesce(is_used, false)) AS used_codes FROM registration_codes"
+            ),
+        )
+        
+        # Trainer stats, with per-trainer user and message counts already aggregated by trainer_dashboard_stats()
+        total_trainers = len(trainers)
+        active_trainers = len([t for t in trainers if t["is_active"]])
+        
+        # Registration codes stats
+        total_codes = code_stats["total_codes"]
+        used_codes = code_stats["used_codes"]
+        active_codes = total_codes - used_codes
         usage_rate = (used_codes / total_codes * 100) if total_codes > 0 else 0
         
-        # Get trainer performance data
-        trainer_performance = []
-        for trainer in (trainers_response.data or []):
-            # Get user count for this trainer
-            trainer_users_response = supabase.table("users").select("id").eq("selected_trainer_id", trainer["id"]).execute()
-            trainer_user_count = len(trainer_users_response.data or [])
-            
-            # Get message count for this trainer
-            trainer_messages_response = supabase.table("bot_messages").select("id").eq("trainer_id", trainer["id"]).execute()
-            trainer_message_count = len(trainer_messages_response.data or [])
-            
-            trainer_performance.append({
+        # Get trainer performance data, already sorted by message count
+        trainer_performance = [
+            {
                 "trainer_id": trainer["id"],
-                "trainer_name": trainer.get("name", "Unknown"),
-                "total_messages": trainer_message_count,
-                "total_users": trainer_user_count,
-                "is_active": trainer.get("is_active", True)
-            })
-        
-        # Sort by message count
-        trainer_performance.sort(key=lambda x: x["total_messages"], reverse=True)
+                "trainer_name": trainer["name"] or "Unknown",
+                "total_messages": trainer["message_count"],
+                "total_users": trainer["user_count"],
+                "is_active": trainer["is_active"]
+            }
+            for trainer in trainers
+        ]
         
         return {
             "overview": {
@@ -679,9 +896,7 @@ async def get_admin_analytics(current_user = Depends(require_admin)):
             }
         }
     except Exception as e:
-        print(f"Error fetching admin analytics: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error fetching admin analytics: %s", e)
         # Return mock data if there's an error
         return {
             "overview": {
@@ -717,156 +932,140 @@ async def get_admin_analytics(current_user = Depends(require_admin)):
         }
 
 @app.get("/admin/registration-codes")
-async def get_registration_codes(current_user = Depends(require_admin)):
-    response = supabase.table("registration_codes").select("*").order("created_at", desc=True).execute()
-    return response.data
+async def get_registration_codes(current_user = Depends(require_admin), db: asyncpg.Pool = Depends(get_pool)):
+    rows = await db.fetch("SELECT * FROM registration_codes ORDER BY created_at DESC")
+    return [dict(row) for row in rows]
 
 @app.put("/admin/registration-codes/{code_id}/deactivate")
 async def deactivate_registration_code(
     code_id: str,
-    current_user = Depends(require_admin)
+    current_user = Depends(require_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     try:
-        # Check if code exists
-        code_response = supabase.table("registration_codes").select("*").eq("id", code_id).execute()
-        if not code_response.data:
-            raise HTTPException(status_code=404, detail="Registration code not found")
-        
         # Deactivate the code by marking it as used
-        supabase.table("registration_codes").update({"is_used": True}).eq("id", code_id).execute()
+        row = await db.fetchrow("UPDATE registration_codes SET is_used = true WHERE id = $1 RETURNING id", code_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Registration code not found")
         return {"message": "Registration code deactivated successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error deactivating registration code: {e}")
+        logger.error("Error deactivating registration code: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to deactivate registration code: {str(e)}")
 
 @app.put("/admin/registration-codes/{code_id}/activate")
 async def activate_registration_code(
     code_id: str,
-    current_user = Depends(require_admin)
+    current_user = Depends(require_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     try:
-        # Check if code exists
-        code_response = supabase.table("registration_codes").select("*").eq("id", code_id).execute()
-        if not code_response.data:
-            raise HTTPException(status_code=404, detail="Registration code not found")
-        
         # Activate the code by marking it as not used
-        supabase.table("registration_codes").update({"is_used": False}).eq("id", code_id).execute()
+        row = await db.fetchrow("UPDATE registration_codes SET is_used = false WHERE id = $1 RETURNING id", code_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Registration code not found")
         return {"message": "Registration code activated successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error activating registration code: {e}")
+        logger.error("Error activating registration code: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to activate registration code: {str(e)}")
 
 @app.delete("/admin/registration-codes/{code_id}")
 async def delete_registration_code(
     code_id: str,
-    current_user = Depends(require_admin)
+    current_user = Depends(require_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     try:
-        # Check if code exists
-        code_response = supabase.table("registration_codes").select("*").eq("id", code_id).execute()
-        if not code_response.data:
-            raise HTTPException(status_code=404, detail="Registration code not found")
-        
-        # Check if code has been used
-        if code_response.data[0].get("is_used", False):
+        # Delete the code unless it has been used
+        deleted = await db.fetchrow(
+            "DELETE FROM registration_codes WHERE id = $1 AND is_used IS NOT TRUE RETURNING id", code_id
+        )
+        if deleted is None:
+            # Nothing deleted: tell a missing code apart from a used one
+            exists = await db.fetchval("SELECT EXISTS (SELECT 1 FROM registration_codes WHERE id = $1)", code_id)
+            if not exists:
+                raise HTTPException(status_code=404, detail="Registration code not found")
             raise HTTPException(status_code=400, detail="Cannot delete registration code that has been used")
         
-        # Delete the code
-        supabase.table("registration_codes").delete().eq("id", code_id).execute()
         return {"message": "Registration code deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error deleting registration code: {e}")
+        logger.error("Error deleting registration code: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to delete registration code: {str(e)}")
 
 @app.put("/admin/trainers/{trainer_id}/toggle-status")
 async def toggle_trainer_status(
     trainer_id: str,
-    current_user = Depends(require_admin)
+    current_user = Depends(require_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     try:
-        # Check if trainer exists
-        trainer_response = supabase.table("trainers").select("*").eq("id", trainer_id).execute()
-        if not trainer_response.data:
+        # Flip the status in one statement; a missing is_active counts as active
+        trainer = await db.fetchrow(
+            "UPDATE trainers SET is_active = NOT COALESCE(is_active, true) WHERE id = $1 RETURNING is_active", trainer_id
+        )
+        if trainer is None:
             raise HTTPException(status_code=404, detail="Trainer not found")
         
-        current_status = trainer_response.data[0].get("is_active", True)
-        new_status = not current_status
-        
-        # Update trainer status
-        update_response = supabase.table("trainers").update({"is_active": new_status}).eq("id", trainer_id).execute()
-        
-        if update_response.data:
-            return {
-                "message": f"Trainer {'activated' if new_status else 'deactivated'} successfully",
-                "trainer_id": trainer_id,
-                "is_active": new_status
-            }
-        else:
-            raise HTTPException(status_code=500, detail="Failed to update trainer status")
-            
+        _forget_cached_user(trainer_id)
+        return {
+            "message": f"Trainer {'activated' if trainer['is_active'] else 'deactivated'} successfully",
+            "trainer_id": trainer_id,
+            "is_active": trainer["is_active"]
+        }
+
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error toggling trainer status: {e}")
+        logger.error("Error toggling trainer status: %s", e)
         raise HTTPException(status_code=500, detail="Failed to update trainer status")
 
+async def probe_table(db: asyncpg.Pool, table: str) -> str:
+    """Read one row from a fixed table name to check that it is reachable"""
+    try:
+        await db.fetchval(f"SELECT 1 FROM {table} LIMIT 1")
+        return "healthy"
+    except Exception as e:
+        return f"error: {str(e)}"
+
 @app.get("/admin/system-health")
-async def get_system_health(current_user = Depends(require_admin)):
+async def get_system_health(current_user = Depends(require_admin), db: asyncpg.Pool = Depends(get_pool)):
     try:
-        # Check database connectivity
+        # Probe the tables concurrently; the trainers probe doubles as the database connectivity check
+        trainers_status, users_status, messages_status = await asyncio.gather(
+            probe_table(db, "trainers"), probe_table(db, "users"), probe_table(db, "bot_messages")
+        )
         health_checks = {
-            "database": "unknown",
-            "trainers_table": "unknown",
-            "users_table": "unknown",
-            "messages_table": "unknown"
+            "database": trainers_status,
+            "trainers_table": trainers_status,
+            "users_table": users_status,
+            "messages_table": messages_status
         }
         
-        # Test database connection
-        try:
-            test_response = supabase.table("trainers").select("count").execute()
-            health_checks["database"] = "healthy"
-            health_checks["trainers_table"] = "healthy"
-        except Exception as e:
-            health_checks["database"] = f"error: {str(e)}"
-            health_checks["trainers_table"] = f"error: {str(e)}"
-        
-        # Test users table
-        try:
-            users_response = supabase.table("users").select("count").execute()
-            health_checks["users_table"] = "healthy"
-        except Exception as e:
-            health_checks["users_table"] = f"error: {str(e)}"
-        
-        # Test messages table
-        try:
-            messages_response = supabase.table("bot_messages").select("count").execute()
-            health_checks["messages_table"] = "healthy"
-        except Exception as e:
-            health_checks["messages_table"] = f"error: {str(e)}"
-        
         return {
             "status": "healthy" if all("healthy" in str(v) for v in health_checks.values()) else "degraded",
             "checks": health_checks,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": datetime.utcnow()
         }
         
     except Exception as e:
-        print(f"Error checking system health: {e}")
+        logger.error("Error checking system health: %s", e)
         raise HTTPException(status_code=500, detail="Failed to check system health")
 
 # Trainer routes
 @app.get("/trainer/config")
-async def get_trainer_config(current_user = Depends(require_trainer_or_admin)):
-    response = supabase.table("trainer_configurations").select("*").eq("trainer_id", current_user["id"]).execute()
+async def get_trainer_config(current_user = Depends(require_trainer_or_admin), db: asyncpg.Pool = Depends(get_pool)):
+    cached = _trainer_config_cache.get(current_user["id"])
+    if cached is not None:
+        return cached
     
-    if not response.data:
+    config = await db.fetchrow("SELECT * FROM trainer_configurations WHERE trainer_id = $1", current_user["id"])
+    
+    if config is None:
         # Create default config
         default_config = {
             "trainer_id": current_user["id"],
@@ -874,85 +1073,83 @@ async def get_trainer_config(current_user = Depends(require_trainer_or_admin)):
             "diet_preferences": [],
             "reminder_settings": {}
         }
-        supabase.table("trainer_configurations").insert(default_config).execute()
+        await db.execute(
+            """
+            INSERT INTO trainer_configurations (trainer_id, onboarding_questions, diet_preferences, reminder_settings)
+            VALUES ($1, $2, $3, $4)
+            """,
+            default_config["trainer_id"], default_config["onboarding_questions"],
+            default_config["diet_preferences"], default_config["reminder_settings"]
+        )
         return default_config
     
-    return response.data[0]
+    config = _trainer_config_cache[current_user["id"]] = dict(config)
+    return config
+
+# Columns a trainer config update may set
+TRAINER_CONFIG_COLUMNS = frozenset(TrainerConfigUpdate.model_fields)
 
 @app.put("/trainer/config")
 async def update_trainer_config(
     config_data: TrainerConfigUpdate,
-    current_user = Depends(require_trainer_or_admin)
+    current_user = Depends(require_trainer_or_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     # Validate onboarding questions (max 5)
     if config_data.onboarding_questions and len(config_data.onboarding_questions) > 5:
         raise HTTPException(status_code=400, detail="Maximum 5 onboarding questions allowed")
     
-    update_data = {}
-    if config_data.onboarding_questions is not None:
-        update_data["onboarding_questions"] = config_data.onboarding_questions
-    if config_data.diet_preferences is not None:
-        update_data["diet_preferences"] = config_data.diet_preferences
-    if config_data.general_notes is not None:
-        update_data["general_notes"] = config_data.general_notes
-    if config_data.bot_personality is not None:
-        update_data["bot_personality"] = config_data.bot_personality
-    if config_data.reminder_settings is not None:
-        update_data["reminder_settings"] = config_data.reminder_settings
-    
-    update_data["updated_at"] = datetime.utcnow().isoformat()
-    
-    supabase.table("trainer_configurations").update(update_data).eq("trainer_id", current_user["id"]).execute()
+    # Only the fields the client sent are written, so an explicit null clears a field and omitted ones keep their value.
+    # Column names come from the whitelist, never from the request, before they are spliced into the SQL
+    update_data = {
+        column: value for column, value in config_data.model_dump(exclude_unset=True).items() if column in TRAINER_CONFIG_COLUMNS
+    }
+    assignments = [f"{column} = ${position}" for position, column in enumerate(update_data, start=2)]
+    assignments.append("updated_at = now()")
+    await db.execute(
+        f"UPDATE trainer_configurations SET {', '.join(assignments)} WHERE trainer_id = $1",
+        current_user["id"], *update_data.values()
+    )
+    _trainer_config_cache.pop(current_user["id"], None)
     return {"message": "Configuration updated successfully"}
 
 @app.get("/trainer/analytics")
-async def get_trainer_analytics(current_user = Depends(require_trainer_or_admin)):
+async def get_trainer_analytics(current_user = Depends(require_trainer_or_admin), db: asyncpg.Pool = Depends(get_pool)):
     try:
-        print(f"Fetching analytics for trainer: {current_user['id']}")
-        
-        # Get messages for this trainer
-        response = supabase.table("bot_messages").select("*").eq("trainer_id", current_user["id"]).execute()
-        messages = response.data or []
-        
-        print(f"Found {len(messages)} messages for trainer")
-        
-        # Group by date for chart data
-        daily_messages = {}
-        for msg in messages:
-            if msg.get("sent_at"):
-                try:
-                    date = msg["sent_at"][:10]  # Extract date part
-                    daily_messages[date] = daily_messages.get(date, 0) + 1
-                except Exception as e:
-                    print(f"Error processing message date: {e}")
-                    continue
-        
-        # Calculate recent activity (last 7 days)
-        recent_activity = 0
-        seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        for msg in messages:
-            if msg.get("sent_at"):
-                try:
-                    msg_date = datetime.fromisoformat(msg["sent_at"].replace('Z', '+00:00'))
-                    if msg_date >= seven_days_ago:
-                        recent_activity += 1
-                except Exception as e:
-                    print(f"Error processing message date for recent activity: {e}")
-                    continue
+        logger.debug("Fetching analytics for trainer: %s", current_user['id'])
+        
+        # Count this trainer's messages per UTC day, plus those from the last 7 days
+        rows = await db.fetch(
+            """
+            SELECT to_char((sent_at AT TIME ZONE 'UTC')::date, 'YYYY-MM-DD') AS date,
+                   count(*) AS total,
+                   count(*) FILTER (WHERE sent_at >= now() - interval '7 days') AS recent
+            FROM bot_messages
+            WHERE trainer_id = $1
+            GROUP BY 1
+            ORDER BY 1
+            """,
+            current_user["id"]
+        )
+        
+        total_messages = sum(row["total"] for row in rows)
+        logger.debug("Found %s messages for trainer", total_messages)
+        
+        # Group by date for chart data; messages without sent_at only count towards the total
+        daily_messages = {row["date"]: row["total"] for row in rows if row["date"] is not None}
         
         result = {
-            "total_messages": len(messages),
+            "total_messages": total_messages,
             "daily_messages": daily_messages,
-            "recent_activity": recent_activity
+            "recent_activity": sum(row["recent"] for row in rows)
         }
         
-        print(f"Analytics result: {result}")
-        return result
+        logger.debug("Analytics result: %s", result)
+        # Only str/int values, which orjson encodes natively, so skip FastAPI's jsonable_encoder pass
+        return ORJSONResponse(result)
         
     except Exception as e:
-        print(f"Error fetching trainer analytics: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error fetching trainer analytics: %s", e)
         # Return mock data if there's an error
         return {
             "total_messages": 0,
@@ -961,87 +1158,54 @@ async def get_trainer_analytics(current_user = Depends(require_trainer_or_admin)
         }
 
 @app.get("/trainer/users-analytics")
-async def get_trainer_users_analytics(current_user = Depends(require_trainer_or_admin)):
+async def get_trainer_users_analytics(current_user = Depends(require_trainer_or_admin), db: asyncpg.Pool = Depends(get_pool)):
     try:
-        print(f"Fetching users analytics for trainer: {current_user['id']}")
-        
-        # Get all users who have selected this trainer
-        users_response = supabase.table("users").select("*").eq("selected_trainer_id", current_user["id"]).execute()
-        
-        if not users_response.data:
-            return {
-                "total_users": 0,
-                "daily_user_activity": {},
-                "user_interaction_stats": []
-            }
-        
-        # Get all messages for this trainer
-        messages_response = supabase.table("bot_messages").select("*").eq("trainer_id", current_user["id"]).execute()
-        messages = messages_response.data or []
-        
-        # Group messages by date and user
-        daily_user_activity = {}
-        user_interaction_stats = []
-        
-        for user in users_response.data:
-            user_messages = [msg for msg in messages if msg.get("user_id") == user["id"]]
-            
-            # Calculate user interaction stats
-            total_messages = len(user_messages)
-            last_interaction = None
-            if user_messages:
-                # Get the most recent message
-                latest_message = max(user_messages, key=lambda x: x.get("sent_at", ""))
-                last_interaction = latest_message.get("sent_at")
-            
-            user_interaction_stats.append({
-                "user_id": user["id"],
-                "user_name": user.get("name", "Unknown"),
-                "total_messages": total_messages,
-                "last_interaction": last_interaction,
-                "created_at": user.get("created_at")
-            })
-            
-            # Group messages by date for this user
-            for msg in user_messages:
-                if msg.get("sent_at"):
-                    try:
-                        date = msg["sent_at"][:10]  # Extract date part (YYYY-MM-DD)
-                        if date not in daily_user_activity:
-                            daily_user_activity[date] = {
-                                "unique_users": set(),
-                                "total_messages": 0
-                            }
-                        daily_user_activity[date]["unique_users"].add(user["id"])
-                        daily_user_activity[date]["total_messages"] += 1
-                    except Exception as e:
-                        print(f"Error processing message date: {e}")
-                        continue
-        
-        # Convert sets to counts for JSON serialization
-        formatted_daily_activity = {}
-        for date, data in daily_user_activity.items():
-            formatted_daily_activity[date] = {
-                "unique_users_count": len(data["unique_users"]),
-                "total_messages": data["total_messages"]
-            }
-        
-        # Sort user interaction stats by total messages (descending)
-        user_interaction_stats.sort(key=lambda x: x["total_messages"], reverse=True)
+        logger.debug("Fetching users analytics for trainer: %s", current_user['id'])
+        
+        # Per-user stats for the users who selected this trainer, and per-day activity across them, fetched concurrently
+        user_stats, daily_activity = await asyncio.gather(
+            db.fetch(
+                """
+                SELECT u.id::text AS user_id, u.name AS user_name, count(m.id) AS total_messages,
+                       max(m.sent_at) AS last_interaction, u.created_at
+                FROM users u
+                LEFT JOIN bot_messages m ON m.user_id = u.id AND m.trainer_id = $1
+                WHERE u.selected_trainer_id = $1
+                GROUP BY u.id
+                ORDER BY total_messages DESC
+                """,
+                current_user["id"]
+            ),
+            db.fetch(
+                """
+                SELECT to_char((m.sent_at AT TIME ZONE 'UTC')::date, 'YYYY-MM-DD') AS date,
+                       count(DISTINCT m.user_id) AS unique_users_count,
+                       count(*) AS total_messages
+                FROM bot_messages m
+                JOIN users u ON u.id = m.user_id AND u.selected_trainer_id = $1
+                WHERE m.trainer_id = $1 AND m.sent_at IS NOT NULL
+                GROUP BY 1
+                ORDER BY 1
+                """,
+                current_user["id"]
+            ),
+        )
         
         result = {
-            "total_users": len(users_response.data),
-            "daily_user_activity": formatted_daily_activity,
-            "user_interaction_stats": user_interaction_stats
+            "total_users": len(user_stats),
+            "daily_user_activity": {
+                row["date"]: {"unique_users_count": row["unique_users_count"], "total_messages": row["total_messages"]}
+                for row in daily_activity
+            },
+            "user_interaction_stats": [dict(row) for row in user_stats]
         }
         
-        print(f"Users analytics result: {result}")
-        return result
+        logger.debug("Users analytics result: %s", result)
+        # Ids are cast to text in SQL so every value encodes natively in orjson, skipping FastAPI's jsonable_encoder pass
+        return ORJSONResponse(result)
         
     except Exception as e:
-        print(f"Error fetching trainer users analytics: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error fetching trainer users analytics: %s", e)
         # Return empty data if there's an error
         return {
             "total_users": 0,
@@ -1050,43 +1214,48 @@ async def get_trainer_users_analytics(current_user = Depends(require_trainer_or_
         }
 
 @app.get("/trainer/users")
-async def get_trainer_users(current_user = Depends(require_trainer_or_admin)):
+async def get_trainer_users(current_user = Depends(require_trainer_or_admin), db: asyncpg.Pool = Depends(get_pool)):
     try:
-        # Get all users who have selected this trainer
-        response = supabase.table("users").select("*").eq("selected_trainer_id", current_user["id"]).execute()
-        
-        if not response.data:
-            return []
-        
-        # Get message counts for each user
-        users_with_stats = []
-        for user in response.data:
-            # Get message count for this user
-            messages_response = supabase.table("bot_messages").select("id").eq("trainer_id", current_user["id"]).eq("user_id", user["id"]).execute()
-            
-            # Get last interaction date
-            last_message_response = supabase.table("bot_messages").select("sent_at").eq("trainer_id", current_user["id"]).eq("user_id", user["id"]).order("sent_at", desc=True).limit(1).execute()
-            
-            user_with_stats = {
-                **user,
-                "message_count": len(messages_response.data),
-                "last_interaction": last_message_response.data[0]["sent_at"] if last_message_response.data else None
-            }
-            users_with_stats.append(user_with_stats)
+        # Get all users who have selected this trainer, with their message count and last interaction
+        users = await db.fetch(
+            """
+            SELECT u.*, COALESCE(m.message_count, 0) AS message_count, m.last_interaction
+            FROM users u
+            LEFT JOIN (
+                SELECT user_id, count(*) AS message_count, max(sent_at) AS last_interaction
+                FROM bot_messages
+                WHERE trainer_id = $1
+                GROUP BY user_id
+            ) m ON m.user_id = u.id
+            WHERE u.selected_trainer_id = $1
+            """,
+            current_user["id"]
+        )
         
-        return users_with_stats
+        return [dict(user) for user in users]
     except Exception as e:
-        print(f"Error fetching trainer users: {e}")
+        logger.error("Error fetching trainer users: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to fetch users: {str(e)}")
 
 # Question Categories endpoints
+async def load_question_categories(db: asyncpg.Pool) -> list:
+    """Question categories ordered by name, from the process cache or the database"""
+    global _categories_fallback
+    categories = _categories_cache.get("all")
+    if categories is None:
+        rows = await db.fetch("SELECT * FROM question_categories ORDER BY name")
+        categories = _categories_cache["all"] = _categories_fallback = [dict(row) for row in rows]
+    return categories
+
 @app.get("/question-categories")
-async def get_question_categories():
+async def get_question_categories(db: asyncpg.Pool = Depends(get_pool)):
     try:
-        response = supabase.table("question_categories").select("*").order("name").execute()
-        return response.data
+        return await load_question_categories(db)
     except Exception as e:
-        print(f"Error fetching question categories: {e}")
+        logger.error("Error fetching question categories: %s", e)
+        # Serve the last good list rather than failing while the database is unavailable
+        if _categories_fallback is not None:
+            return _categories_fallback
         raise HTTPException(status_code=500, detail=f"Failed to fetch categories: {str(e)}")
 
 # Admin category management endpoints
@@ -1094,321 +1263,301 @@ async def get_question_categories():
 @app.post("/admin/question-categories")
 async def create_question_category(
     category_data: CategoryCreate,
-    current_user = Depends(require_admin)
+    current_user = Depends(require_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     try:
-        # Check if category already exists
-        existing_response = supabase.table("question_categories").select("*").eq("name", category_data.name).execute()
-        if existing_response.data:
-            raise HTTPException(status_code=400, detail="Category already exists")
-        
-        # Create new category
-        new_category = {
-            "name": category_data.name
-        }
-        
-        response = supabase.table("question_categories").insert(new_category).execute()
-        return {"message": "Category created successfully", "category": response.data[0]}
+        # Create new category; the unique name index rejects duplicates
+        category = await db.fetchrow("INSERT INTO question_categories (name) VALUES ($1) RETURNING *", category_data.name)
+        _categories_cache.clear()
+        return {"message": "Category created successfully", "category": dict(category)}
+    except asyncpg.UniqueViolationError:
+        raise HTTPException(status_code=400, detail="Category already exists")
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error creating category: {e}")
+        logger.error("Error creating category: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to create category: {str(e)}")
 
 @app.put("/admin/question-categories/{category_id}")
 async def update_question_category(
     category_id: str,
     category_data: CategoryUpdate,
-    current_user = Depends(require_admin)
+    current_user = Depends(require_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     try:
-        # Check if category exists
-        existing_response = supabase.table("question_categories").select("*").eq("id", category_id).execute()
-        if not existing_response.data:
+        # Update category; the unique name index rejects a name taken by another category
+        category = await db.fetchrow(
+            "UPDATE question_categories SET name = $2 WHERE id = $1 RETURNING *", category_id, category_data.name
+        )
+        if category is None:
             raise HTTPException(status_code=404, detail="Category not found")
         
-        # Check if new name already exists (excluding current category)
-        name_check_response = supabase.table("question_categories").select("*").eq("name", category_data.name).neq("id", category_id).execute()
-        if name_check_response.data:
-            raise HTTPException(status_code=400, detail="Category name already exists")
-        
-        # Update category
-        update_data = {"name": category_data.name}
-        response = supabase.table("question_categories").update(update_data).eq("id", category_id).execute()
-        
-        return {"message": "Category updated successfully", "category": response.data[0]}
+        _categories_cache.clear()
+        return {"message": "Category updated successfully", "category": dict(category)}
+    except asyncpg.UniqueViolationError:
+        raise HTTPException(status_code=400, detail="Category name already exists")
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error updating category: {e}")
+        logger.error("Error updating category: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to update category: {str(e)}")
 
 @app.delete("/admin/question-categories/{category_id}")
 async def delete_question_category(
     category_id: str,
-    current_user = Depends(require_admin)
+    current_user = Depends(require_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     try:
-        # Check if category exists
-        existing_response = supabase.table("question_categories").select("*").eq("id", category_id).execute()
-        if not existing_response.data:
-            raise HTTPException(status_code=404, detail="Category not found")
-        
-        # Check if category is being used by any questions
-        questions_response = supabase.table("trainer_questions").select("id").eq("category_id", category_id).execute()
-        if questions_response.data:
+        # Delete category unless any question still uses it
+        deleted = await db.fetchrow(
+            """
+            DELETE FROM question_categories
+            WHERE id = $1 AND NOT EXISTS (SELECT 1 FROM trainer_questions WHERE category_id = $1)
+            RETURNING id
+            """,
+            category_id
+        )
+        if deleted is None:
+            # Nothing deleted: tell a missing category apart from one in use
+            exists = await db.fetchval("SELECT EXISTS (SELECT 1 FROM question_categories WHERE id = $1)", category_id)
+            if not exists:
+                raise HTTPException(status_code=404, detail="Category not found")
             raise HTTPException(status_code=400, detail="Cannot delete category that is being used by questions")
         
-        # Delete category
-        supabase.table("question_categories").delete().eq("id", category_id).execute()
+        _categories_cache.clear()
         return {"message": "Category deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error deleting category: {e}")
+        logger.error("Error deleting category: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to delete category: {str(e)}")
 
 # Trainer Questions endpoints
 @app.get("/trainer/questions")
-async def get_trainer_questions(current_user = Depends(require_trainer_or_admin)):
+async def get_trainer_questions(current_user = Depends(require_trainer_or_admin), db: asyncpg.Pool = Depends(get_pool)):
     try:
-        # First get the questions - using correct column names from actual DB
-        questions_response = supabase.table("trainer_questions").select("*").eq("trainer_id", current_user["id"]).order("step").execute()
-        
-        if not questions_response.data:
-            return []
-        
-        # Get categories for the questions
-        category_ids = list(set([q["category_id"] for q in questions_response.data]))
-        categories_response = supabase.table("question_categories").select("*").in_("id", category_ids).execute()
-        
-        # Create a lookup map for categories
-        categories_map = {cat["id"]: cat for cat in categories_response.data}
-        
-        # Combine questions with their categories and normalize field names
-        questions_with_categories = []
-        for question in questions_response.data:
-            question_with_category = question.copy()
-            # Map the actual DB fields to expected frontend fields
-            question_with_category["question_text"] = question.get("content", "")
-            question_with_category["step_order"] = question.get("step", 1)
-            question_with_category["question_categories"] = categories_map.get(question["category_id"], {})
-            questions_with_categories.append(question_with_category)
-        
-        return questions_with_categories
+        # Questions with their category in one query, aliasing the DB fields ('content', 'step') to the frontend names
+        questions = await db.fetch(
+            """
+            SELECT q.*, q.content AS question_text, q.step AS step_order,
+                   COALESCE(to_jsonb(c.*), '{}'::jsonb) AS question_categories
+            FROM trainer_questions q
+            LEFT JOIN question_categories c ON c.id = q.category_id
+            WHERE q.trainer_id = $1
+            ORDER BY q.step
+            """,
+            current_user["id"]
+        )
+        
+        return [dict(question) for question in questions]
     except Exception as e:
-        print(f"Error fetching trainer questions: {e}")
+        logger.error("Error fetching trainer questions: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to fetch questions: {str(e)}")
 
 @app.post("/trainer/questions")
 async def create_trainer_question(
     question_data: QuestionCreate,
-    current_user = Depends(require_trainer_or_admin)
+    current_user = Depends(require_trainer_or_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     try:
-        print(f"Creating question with data: {question_data}")
-        print(f"Current user: {current_user['id']}")
+        logger.debug("Creating question with data: %s", question_data)
+        logger.debug("Current user: %s", current_user['id'])
         
-        # Check if category exists
-        category_response = supabase.table("question_categories").select("*").eq("id", question_data.category_id).execute()
-        if not category_response.data:
+        # Check if category exists against the cached categories; only an unknown id, which may be
+        # a category created on another worker since the cache was filled, goes to the database
+        try:
+            category_id = uuid.UUID(question_data.category_id)
+        except ValueError:
             raise HTTPException(status_code=400, detail="Invalid category ID")
+        categories = await load_question_categories(db)
+        if not any(category["id"] == category_id for category in categories):
+            category = await db.fetchrow("SELECT id FROM question_categories WHERE id = $1", category_id)
+            if category is None:
+                raise HTTPException(status_code=400, detail="Invalid category ID")
+        
+        # Create the question using correct column names ('content' and 'step')
+        question = await db.fetchrow(
+            "INSERT INTO trainer_questions (trainer_id, category_id, content, step) VALUES ($1, $2, $3, $4) RETURNING *",
+            current_user["id"], category_id, question_data.question_text, question_data.step_order
+        )
+        logger.debug("Inserted question: %s", question)
         
-        # Create the question using correct column names
-        new_question = {
-            "trainer_id": current_user["id"],
-            "category_id": question_data.category_id,
-            "content": question_data.question_text,  # Map to 'content' column
-            "step": question_data.step_order,        # Map to 'step' column
-        }
-        
-        print(f"Inserting question: {new_question}")
-        response = supabase.table("trainer_questions").insert(new_question).execute()
-        print(f"Insert response: {response}")
-        
-        return {"message": "Question created successfully", "question": response.data[0]}
+        return {"message": "Question created successfully", "question": dict(question)}
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error creating question: {e}")
+        logger.error("Error creating question: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to create question: {str(e)}")
 
 @app.put("/trainer/questions/{question_id}")
 async def update_trainer_question(
     question_id: str,
     question_data: QuestionUpdate,
-    current_user = Depends(require_trainer_or_admin)
+    current_user = Depends(require_trainer_or_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
-    # Check if question exists and belongs to trainer
-    existing_response = supabase.table("trainer_questions").select("*").eq("id", question_id).eq("trainer_id", current_user["id"]).execute()
-    if not existing_response.data:
+    # Update the question if it belongs to the trainer, using correct column names ('content' and 'step');
+    # None keeps the stored value
+    question = await db.fetchrow(
+        """
+        UPDATE trainer_questions SET
+            content = COALESCE($3, content),
+            step = COALESCE($4, step),
+            updated_at = now()
+        WHERE id = $1 AND trainer_id = $2
+        RETURNING *
+        """,
+        question_id, current_user["id"], question_data.question_text, question_data.step_order
+    )
+    if question is None:
         raise HTTPException(status_code=404, detail="Question not found")
-    
-    # Update the question using correct column names
-    update_data = {}
-    if question_data.question_text is not None:
-        update_data["content"] = question_data.question_text  # Map to 'content' column
-    if question_data.step_order is not None:
-        update_data["step"] = question_data.step_order        # Map to 'step' column
-    
-    update_data["updated_at"] = datetime.utcnow().isoformat()
-    
-    response = supabase.table("trainer_questions").update(update_data).eq("id", question_id).execute()
-    return {"message": "Question updated successfully", "question": response.data[0]}
+    return {"message": "Question updated successfully", "question": dict(question)}
 
 @app.delete("/trainer/questions/{question_id}")
 async def delete_trainer_question(
     question_id: str,
-    current_user = Depends(require_trainer_or_admin)
+    current_user = Depends(require_trainer_or_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
-    # Check if question exists and belongs to trainer
-    existing_response = supabase.table("trainer_questions").select("*").eq("id", question_id).eq("trainer_id", current_user["id"]).execute()
-    if not existing_response.data:
+    # Delete the question if it belongs to the trainer
+    deleted = await db.fetchrow(
+        "DELETE FROM trainer_questions WHERE id = $1 AND trainer_id = $2 RETURNING id", question_id, current_user["id"]
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Question not found")
-    
-    # Delete the question
-    supabase.table("trainer_questions").delete().eq("id", question_id).execute()
     return {"message": "Question deleted successfully"}
 
 # Reminder Settings endpoints
 @app.get("/trainer/reminder-settings")
-async def get_trainer_reminder_settings(current_user = Depends(require_trainer_or_admin)):
+async def get_trainer_reminder_settings(current_user = Depends(require_trainer_or_admin), db: asyncpg.Pool = Depends(get_pool)):
     """Get all reminder settings for a trainer"""
     try:
         trainer_id = current_user["id"]
         
         # Get meal reminders
-        meal_response = supabase.table("trainer_reminder_settings").select("*").eq("trainer_id", trainer_id).execute()
-        meal_reminders = meal_response.data or []
+        meal_reminders = await db.fetch("SELECT * FROM trainer_reminder_settings WHERE trainer_id = $1", trainer_id)
         
         # Get weight reminder settings
-        weight_response = supabase.table("trainer_weight_settings").select("*").eq("trainer_id", trainer_id).execute()
-        weight_settings = weight_response.data[0] if weight_response.data else None
+        weight_settings = await db.fetchrow("SELECT * FROM trainer_weight_settings WHERE trainer_id = $1", trainer_id)
         
         # Get summary reminder settings
-        summary_response = supabase.table("trainer_summary_settings").select("*").eq("trainer_id", trainer_id).execute()
-        summary_settings = summary_response.data[0] if summary_response.data else None
+        summary_settings = await db.fetchrow("SELECT * FROM trainer_summary_settings WHERE trainer_id = $1", trainer_id)
         
         return {
-            "meal_reminders": meal_reminders,
-            "weight_reminder": weight_settings,
-            "summary_reminder": summary_settings
+            "meal_reminders": [dict(row) for row in meal_reminders],
+            "weight_reminder": dict(weight_settings) if weight_settings else None,
+            "summary_reminder": dict(summary_settings) if summary_settings else None
         }
     except Exception as e:
-        print(f"Error fetching reminder settings: {e}")
+        logger.error("Error fetching reminder settings: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to fetch reminder settings: {str(e)}")
 
+# Meal reminders are replaced wholesale; weight/summary settings hold one row per trainer
+INSERT_MEAL_REMINDER_SQL = """
+    INSERT INTO trainer_reminder_settings (trainer_id, reminder_type, hour, minute, hours_since_last_meal, enabled)
+    VALUES ($1, $2, $3, $4, $5, $6)
+"""
+UPSERT_WEIGHT_SETTINGS_SQL = """
+    INSERT INTO trainer_weight_settings (trainer_id, reminder_hour, reminder_minute, reminder_interval_days, enabled)
+    VALUES ($1, $2, $3, $4, $5)
+    ON CONFLICT (trainer_id) DO UPDATE SET
+        reminder_hour = EXCLUDED.reminder_hour,
+        reminder_minute = EXCLUDED.reminder_minute,
+        reminder_interval_days = EXCLUDED.reminder_interval_days,
+        enabled = EXCLUDED.enabled
+"""
+UPSERT_SUMMARY_SETTINGS_SQL = """
+    INSERT INTO trainer_summary_settings (trainer_id, summary_hour, summary_minute, enabled)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (trainer_id) DO UPDATE SET
+        summary_hour = EXCLUDED.summary_hour,
+        summary_minute = EXCLUDED.summary_minute,
+        enabled = EXCLUDED.enabled
+"""
+
 @app.put("/trainer/reminder-settings")
 async def update_trainer_reminder_settings(
     settings_data: TrainerReminderSettingsUpdate,
-    current_user = Depends(require_trainer_or_admin)
+    current_user = Depends(require_trainer_or_admin),
+    db: asyncpg.Pool = Depends(get_pool)
 ):
     """Update reminder settings for a trainer"""
     try:
         trainer_id = current_user["id"]
         
-        # Update meal reminders
-        if settings_data.meal_reminders is not None:
-            # Delete existing meal reminders
-            supabase.table("trainer_reminder_settings").delete().eq("trainer_id", trainer_id).execute()
-            
-            # Insert new meal reminders
-            for reminder in settings_data.meal_reminders:
-                reminder_data = {
-                    "trainer_id": trainer_id,
-                    "reminder_type": reminder.reminder_type,
-                    "hour": reminder.hour,
-                    "minute": reminder.minute,
-                    "hours_since_last_meal": reminder.hours_since_last_meal,
-                    "enabled": reminder.enabled
-                }
-                supabase.table("trainer_reminder_settings").insert(reminder_data).execute()
-        
-        # Update weight reminder settings
-        if settings_data.weight_reminder is not None:
-            weight_data = {
-                "trainer_id": trainer_id,
-                "reminder_hour": settings_data.weight_reminder.reminder_hour,
-                "reminder_minute": settings_data.weight_reminder.reminder_minute,
-                "reminder_interval_days": settings_data.weight_reminder.reminder_interval_days,
-                "enabled": settings_data.weight_reminder.enabled
-            }
-            
-            # Check if weight settings exist
-            existing_weight = supabase.table("trainer_weight_settings").select("*").eq("trainer_id", trainer_id).execute()
-            if existing_weight.data:
-                supabase.table("trainer_weight_settings").update(weight_data).eq("trainer_id", trainer_id).execute()
-            else:
-                supabase.table("trainer_weight_settings").insert(weight_data).execute()
-        
-        # Update summary reminder settings
-        if settings_data.summary_reminder is not None:
-            summary_data = {
-                "trainer_id": trainer_id,
-                "summary_hour": settings_data.summary_reminder.summary_hour,
-                "summary_minute": settings_data.summary_reminder.summary_minute,
-                "enabled": settings_data.summary_reminder.enabled
-            }
-            
-            # Check if summary settings exist
-            existing_summary = supabase.table("trainer_summary_settings").select("*").eq("trainer_id", trainer_id).execute()
-            if existing_summary.data:
-                supabase.table("trainer_summary_settings").update(summary_data).eq("trainer_id", trainer_id).execute()
-            else:
-                supabase.table("trainer_summary_settings").insert(summary_data).execute()
+        # Apply every section in one transaction, so a failed write leaves the old settings intact
+        async with db.acquire() as conn:
+            async with conn.transaction():
+                # Replace meal reminders
+                if settings_data.meal_reminders is not None:
+                    await conn.execute("DELETE FROM trainer_reminder_settings WHERE trainer_id = $1", trainer_id)
+                    await conn.executemany(INSERT_MEAL_REMINDER_SQL, [
+                        (trainer_id, r.reminder_type, r.hour, r.minute, r.hours_since_last_meal, r.enabled)
+                        for r in settings_data.meal_reminders
+                    ])
+                
+                # Upsert weight reminder settings
+                if settings_data.weight_reminder is not None:
+                    weight = settings_data.weight_reminder
+                    await conn.execute(
+                        UPSERT_WEIGHT_SETTINGS_SQL,
+                        trainer_id, weight.reminder_hour, weight.reminder_minute, weight.reminder_interval_days, weight.enabled
+                    )
+                
+                # Upsert summary reminder settings
+                if settings_data.summary_reminder is not None:
+                    summary = settings_data.summary_reminder
+                    await conn.execute(
+                        UPSERT_SUMMARY_SETTINGS_SQL, trainer_id, summary.summary_hour, summary.summary_minute, summary.enabled
+                    )
         
         return {"message": "Reminder settings updated successfully"}
     except Exception as e:
-        print(f"Error updating reminder settings: {e}")
+        logger.error("Error updating reminder settings: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to update reminder settings: {str(e)}")
 
 @app.post("/trainer/reminder-settings/initialize")
-async def initialize_trainer_reminder_settings(current_user = Depends(require_trainer_or_admin)):
+async def initialize_trainer_reminder_settings(current_user = Depends(require_trainer_or_admin), db: asyncpg.Pool = Depends(get_pool)):
     """Initialize default reminder settings for a trainer"""
     try:
         trainer_id = current_user["id"]
         
-        # Check if settings already exist
-        meal_check = supabase.table("trainer_reminder_settings").select("*").eq("trainer_id", trainer_id).execute()
-        weight_check = supabase.table("trainer_weight_settings").select("*").eq("trainer_id", trainer_id).execute()
-        summary_check = supabase.table("trainer_summary_settings").select("*").eq("trainer_id", trainer_id).execute()
-        
-        if meal_check.data or weight_check.data or summary_check.data:
-            raise HTTPException(status_code=400, detail="Reminder settings already exist for this trainer")
-        
-        # Create default meal reminders
-        default_meal_reminders = [
-            {"trainer_id": trainer_id, "reminder_type": "breakfast", "hour": 8, "minute": 0, "hours_since_last_meal": 3, "enabled": True},
-            {"trainer_id": trainer_id, "reminder_type": "lunch", "hour": 13, "minute": 0, "hours_since_last_meal": 4, "enabled": True},
-            {"trainer_id": trainer_id, "reminder_type": "dinner", "hour": 19, "minute": 0, "hours_since_last_meal": 4, "enabled": True},
-            {"trainer_id": trainer_id, "reminder_type": "evening", "hour": 22, "minute": 0, "hours_since_last_meal": 3, "enabled": True}
-        ]
-        
-        for reminder in default_meal_reminders:
-            supabase.table("trainer_reminder_settings").insert(reminder).execute()
-        
-        # Create default weight reminder
-        default_weight = {
-            "trainer_id": trainer_id,
-            "reminder_hour": 9,
-            "reminder_minute": 0,
-            "reminder_interval_days": 3,
-            "enabled": True
-        }
-        supabase.table("trainer_weight_settings").insert(default_weight).execute()
-        
-        # Create default summary reminder
-        default_summary = {
-            "trainer_id": trainer_id,
-            "summary_hour": 22,
-            "summary_minute": 0,
-            "enabled": True
-        }
-        supabase.table("trainer_summary_settings").insert(default_summary).execute()
+        async with db.acquire() as conn:
+            async with conn.transaction():
+                # Check if settings already exist
+                settings_exist = await conn.fetchval(
+                    """
+                    SELECT EXISTS (SELECT 1 FROM trainer_reminder_settings WHERE trainer_id = $1)
+                        OR EXISTS (SELECT 1 FROM trainer_weight_settings WHERE trainer_id = $1)
+                        OR EXISTS (SELECT 1 FROM trainer_summary_settings WHERE trainer_id = $1)
+                    """,
+                    trainer_id
+                )
+                
+                if settings_exist:
+                    raise HTTPException(status_code=400, detail="Reminder settings already exist for this trainer")
+                
+                # Create default meal reminders
+                await conn.executemany(INSERT_MEAL_REMINDER_SQL, [
+                    (trainer_id, "breakfast", 8, 0, 3, True),
+                    (trainer_id, "lunch", 13, 0, 4, True),
+                    (trainer_id, "dinner", 19, 0, 4, True),
+                    (trainer_id, "evening", 22, 0, 3, True),
+                ])
+                
+                # Create default weight and summary reminders
+                await conn.execute(UPSERT_WEIGHT_SETTINGS_SQL, trainer_id, 9, 0, 3, True)
+                await conn.execute(UPSERT_SUMMARY_SETTINGS_SQL, trainer_id, 22, 0, True)
         
         return {"message": "Default reminder settings initialized successfully"}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error initializing reminder settings: {e}")
+        logger.error("Error initializing reminder settings: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to initialize reminder settings: {str(e)}")
 
 if __name__ == "__main__":
@@ -0,0 +1,36 @@
+-- Per-trainer user/message counts for GET /admin/trainers in one round-trip
+create or replace function trainer_dashboard_stats()
+returns table (
+    id uuid,
+    name text,
+    email text,
+    is_active boolean,
+    created_at timestamptz,
+    user_count bigint,
+    message_count bigint,
+    last_activity timestamptz
+)
+language sql
+stable
+as $$
+    select
+        t.id,
+        t.name::text,
+        t.email::text,
+        coalesce(t.is_active, true),
+        t.created_at::timestamptz,
+        coalesce(u.user_count, 0),
+        coalesce(m.message_count, 0),
+        m.last_activity::timestamptz
+    from trainers t
+    left join (
+        select selected_trainer_id, count(*) as user_count
+        from users
+        group by selected_trainer_id
+    ) u on u.selected_trainer_id = t.id
+    left join (
+        select trainer_id, count(*) as message_count, max(sent_at) as last_activity
+        from bot_messages
+        group by trainer_id
+    ) m on m.trainer_id = t.id;
+$$;
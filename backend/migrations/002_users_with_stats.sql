@@ -0,0 +1,18 @@
+-- Users with their trainer name and message stats for GET /admin/users.
+-- The backend reads this over asyncpg, so it is not exposed through PostgREST: security_invoker keeps RLS on
+-- the underlying tables in force, and the Supabase API roles lose the default grants on new public views.
+create or replace view users_with_stats with (security_invoker = true) as
+select
+    u.*,
+    coalesce(t.name, 'No trainer') as trainer_name,
+    coalesce(m.message_count, 0) as message_count,
+    m.last_interaction
+from users u
+left join trainers t on t.id = u.selected_trainer_id
+left join (
+    select user_id, count(*) as message_count, max(sent_at) as last_interaction
+    from bot_messages
+    group by user_id
+) m on m.user_id = u.id;
+
+revoke all on users_with_stats from anon, authenticated;
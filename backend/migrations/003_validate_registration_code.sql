@@ -0,0 +1,15 @@
+-- Registration code lookup for POST /auth/register; returns no rows unless the
+-- code is unused, unassigned and not expired
+create or replace function validate_registration_code(p_code text)
+returns setof registration_codes
+language sql
+stable
+as $$
+    select *
+    from registration_codes
+    where code = p_code
+      and not coalesce(is_used, false)
+      and used_by is null
+      and (expires_at is null or expires_at > now())
+    limit 1;
+$$;
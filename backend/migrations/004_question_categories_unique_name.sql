@@ -0,0 +1,2 @@
+-- Category names are unique, so create/rename can rely on the constraint instead of a preflight SELECT
+create unique index if not exists question_categories_name_key on question_categories (name);
@@ -0,0 +1,3 @@
+-- One weight/summary settings row per trainer, so reminder updates can upsert with ON CONFLICT (trainer_id)
+create unique index if not exists trainer_weight_settings_trainer_id_key on trainer_weight_settings (trainer_id);
+create unique index if not exists trainer_summary_settings_trainer_id_key on trainer_summary_settings (trainer_id);
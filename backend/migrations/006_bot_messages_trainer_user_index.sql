@@ -0,0 +1,2 @@
+-- Covers the per-user count/max(sent_at) aggregate behind GET /trainer/users
+create index if not exists bot_messages_trainer_user_sent_at_idx on bot_messages (trainer_id, user_id, sent_at desc);
@@ -0,0 +1,15 @@
+-- Indexes behind the trainer dashboard queries; (trainer_id, user_id, sent_at) and unique
+-- question_categories(name) already exist from migrations 006 and 004.
+-- On a large live table run each statement on its own as CREATE INDEX CONCURRENTLY to avoid blocking writes.
+
+-- Per-day analytics and last-7-days counts for one trainer
+create index if not exists bot_messages_trainer_sent_at_idx on bot_messages (trainer_id, sent_at desc);
+
+-- Users who selected a trainer (trainer users, users analytics, dashboard stats)
+create index if not exists users_selected_trainer_id_idx on users (selected_trainer_id);
+
+-- A trainer's questions in step order
+create index if not exists trainer_questions_trainer_step_idx on trainer_questions (trainer_id, step);
+
+-- A trainer's meal reminders
+create index if not exists trainer_reminder_settings_trainer_id_idx on trainer_reminder_settings (trainer_id);
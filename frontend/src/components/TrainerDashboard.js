@@ -425,7 +425,7 @@ const TrainerDashboard = () => {
     setChangeNameLoading(true);
     console.log(values.name)
     try {
-      await axios.put('/auth/change-name', {
+      const response = await axios.put('/auth/change-name', {
         name: values.name
       });
       message.success('Name changed successfully!');
@@ -433,7 +433,7 @@ const TrainerDashboard = () => {
       // Reset form fields
       changeNameForm.resetFields();
       // Refresh user data without page reload
-      await updateUserInfo();
+      await updateUserInfo(response.data.access_token);
     } catch (error) {
       console.error('Change name error:', error);
       message.error(error.response?.data?.detail || 'Failed to change name');
@@ -446,12 +446,12 @@ const TrainerDashboard = () => {
     if (newName === user?.name || !newName.trim()) return;
     
     try {
-      await axios.put('/auth/change-name', {
+      const response = await axios.put('/auth/change-name', {
         name: newName.trim()
       });
       message.success('Name updated successfully!');
       // Refresh user data without page reload
-      await updateUserInfo();
+      await updateUserInfo(response.data.access_token);
     } catch (error) {
       console.error('Inline name change error:', error);
       message.error(error.response?.data?.detail || 'Failed to update name');
@@ -99,8 +99,13 @@ export const AuthProvider = ({ children }) => {
   };
 
 
-  const updateUserInfo = useCallback(async () => {
+  const updateUserInfo = useCallback(async (newToken) => {
     try {
+      // Profile changes re-issue the token, since /auth/me reads the user from it
+      if (newToken) {
+        localStorage.setItem('token', newToken);
+        axios.defaults.headers.common['Authorization'] = `Bearer ${newToken}`;
+      }
       console.log('Updating user info...');
       const response = await axios.get('/auth/me');
       console.log('User info updated:', response.data);